@@ -1,11 +1,15 @@
 """CV serving Flask app"""
 
 import base64
+import ipaddress
 import json
+import math
 import os
 import re
+import time
 import uuid
 import zlib
+from collections import OrderedDict
 from contextlib import contextmanager
 from datetime import datetime, timedelta
 from threading import RLock
@@ -19,14 +23,27 @@ from typing import (
     Any,
     Mapping,
     Collection,
+    Tuple,
+    List,
+    Union,
 )
 
 import dataset
 import pytimeparse
-from flask import Flask, Request, Response, render_template, abort, request
+from flask import (
+    Flask,
+    Request,
+    Response,
+    render_template,
+    abort,
+    request,
+    url_for,
+    jsonify,
+)
 from flask_httpauth import HTTPBasicAuth
 from sqlalchemy import Integer, UnicodeText, Boolean, DateTime, Column
 from werkzeug.local import LocalProxy
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.security import check_password_hash
 
 
@@ -37,8 +54,40 @@ CONNECTIONS_TABLE_NAME: str = "connections"
 DB_FILENAME: str = "app.db.sqlite"
 DB_PATH: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), DB_FILENAME)
 
+CV_DATA_URL: str = "static/cvdata.json"
+CV_DATA_PATH: str = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), CV_DATA_URL
+)
+VARIANTS_DIRNAME: str = "variants"
+VARIANTS_PATH: str = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), VARIANTS_DIRNAME
+)
+VARIANT_NAME_REGEX: re.Pattern = re.compile(r"[\w-]+")
+VARIANT_SECTIONS_ORDER_KEY: str = "sectionsOrder"
+COMPILED_CV_CACHE_SIZE: int = 256
+
+# Admission control identifies clients by their ip address: when the app is served
+# behind reverse proxies, TRUSTED_PROXY_COUNT must be set to the number of proxies
+# in front of it, so that the client ip is read from their X-Forwarded-For headers,
+# otherwise all visitors would share the same budget of the proxy address.
+TRUSTED_PROXY_COUNT: int = 0
+ADMISSION_VALID_RATE: float = 1.0  # tokens per second
+ADMISSION_VALID_BURST: float = 30.0
+ADMISSION_INVALID_RATE: float = 1.0 / 60.0  # tokens per second
+ADMISSION_INVALID_BURST: float = 5.0
+ADMISSION_MAX_CLIENTS: int = 10000
+ADMISSION_IDLE_SECONDS: float = 3600.0
+ADMISSION_LOG_SAMPLE: int = 100
+ADMISSION_MAX_OFFENDERS: int = 50
+ADMISSION_RECENT_TOKENS: int = 1024
+ADMISSION_RECENT_TOKENS_TTL: float = 60.0
+
 
 app: Flask = Flask(__name__)
+if TRUSTED_PROXY_COUNT:
+    app.wsgi_app = ProxyFix(
+        app.wsgi_app, x_for=TRUSTED_PROXY_COUNT, x_proto=TRUSTED_PROXY_COUNT
+    )
 auth: HTTPBasicAuth = HTTPBasicAuth()
 database: dataset.Database = dataset.connect(
     url=f"sqlite:///{DB_PATH}",
@@ -93,6 +142,7 @@ class Token(TypedDict):
     name: str
     active: bool
     expiry: datetime
+    variant: Optional[str]
 
 
 class LoggedConnection(TypedDict, total=False):
@@ -132,6 +182,7 @@ def ensure_db_schema() -> None:
             Column("name", UnicodeText, nullable=False),
             Column("active", Boolean, nullable=False),
             Column("expiry", DateTime, nullable=False),
+            Column("variant", UnicodeText, nullable=True),
         ]
     )
     connections_table: dataset.Table = database.create_table(
@@ -165,21 +216,30 @@ def db_context() -> Iterator[dataset.Database]:
             raise
 
 
-def validate_token(token_id: str) -> bool:
+def get_valid_token(token_id: str) -> Optional[Token]:
     """
-    Validates a token by its id against the database
-    :param token_id: the token id to validate
-    :return: True if the token id is valid, False otherwise
+    Retrieves a token by its id from the database, validating it
+    :param token_id: the token id to retrieve
+    :return: the token object if the token id is valid, None otherwise
     """
     with db_context() as db:
         tokens_table: dataset.Table = db[TOKEN_TABLE_NAME]
         token_db: Optional[MutableMapping] = tokens_table.find_one(id=token_id)
     if token_db is None:
-        return False
+        return None
     token: Token = Token(**token_db)
     if not token["active"] or datetime.now() > token["expiry"]:
-        return False
-    return True
+        return None
+    return token
+
+
+def validate_token(token_id: str) -> bool:
+    """
+    Validates a token by its id against the database
+    :param token_id: the token id to validate
+    :return: True if the token id is valid, False otherwise
+    """
+    return get_valid_token(token_id) is not None
 
 
 @app.route("/create_token/<string:token_name>")
@@ -191,6 +251,8 @@ def create_token(token_name: str) -> str:
     Additional query arguments:
      - "expiry": optional, a string indicating the time interval from now by which
            the token will expire (same format used by `pytimeparse`)
+     - "variant": optional, the name of a CV variant overlay (a json file in the
+           variants directory, without extension) to serve for this token
     :param token_name: the name of the newly-created token
     :return: a simple plaintext response containing the id of the created token
     """
@@ -205,10 +267,22 @@ def create_token(token_name: str) -> str:
     else:
         token_expiry_delta = timedelta(days=60)
     token_expiry: datetime = datetime.now() + token_expiry_delta
+    variant: Optional[str] = request.args.get("variant") or None
+    if variant is not None:
+        try:
+            compiled_cv_cache.get(variant)
+        except (FileNotFoundError, ValueError) as exc:
+            abort(400, f'CV variant "{variant}" cannot be served: {exc}')
     token_id: str = base64.b64encode(
         zlib.adler32(uuid.uuid4().bytes).to_bytes(4, "little")
     ).decode()[:6]
-    token: Token = Token(id=token_id, name=token_name, active=True, expiry=token_expiry)
+    token: Token = Token(
+        id=token_id,
+        name=token_name,
+        active=True,
+        expiry=token_expiry,
+        variant=variant,
+    )
     with db_context() as db:
         tokens_table: dataset.Table = db[TOKEN_TABLE_NAME]
         tokens_table.insert(token)
@@ -292,34 +366,635 @@ def log_request(
         connections_table.insert(connection)
 
 
+FileVersion = Tuple[int, int]
+
+
+class CompiledCV(TypedDict):
+    """TypedDict class for compiled (and possibly merged) CV data documents"""
+
+    data: Mapping[str, Any]
+    json: bytes
+    etag: str
+    title: str
+    repo_url: Optional[str]
+
+
+CompiledCVEntry = Tuple[Tuple[Optional[FileVersion], ...], Union[CompiledCV, Exception]]
+
+
+def variant_path(variant: str) -> str:
+    """
+    Gets the path of a CV variant overlay file from its name
+    :param variant: the name of the variant
+    :return: the path of the variant overlay json file
+    """
+    if not VARIANT_NAME_REGEX.fullmatch(variant):
+        raise ValueError(f"Invalid CV variant name: {variant!r}")
+    return os.path.join(VARIANTS_PATH, f"{variant}.json")
+
+
+def file_version(path: str) -> Optional[FileVersion]:
+    """
+    Gets a cheap version identifier of a file, to detect changes without reading it
+    :param path: the path of the file
+    :return: a (modification time ns, size) tuple, or None if the file doesn't exist
+    """
+    try:
+        stat: os.stat_result = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def merge_cv_data(
+    base: Mapping[str, Any], overlay: Mapping[str, Any]
+) -> MutableMapping[str, Any]:
+    """
+    Recursively merges a variant overlay onto CV data, without altering either.
+    Mappings are merged key by key, a null value in the overlay removes the key,
+    while any other value (including lists) replaces the base one.
+    :param base: the base CV data
+    :param overlay: the overlay data to merge onto the base
+    :return: the merged CV data
+    """
+    merged: MutableMapping[str, Any] = dict(base)
+    for key, value in overlay.items():
+        if value is None:
+            merged.pop(key, None)
+        elif isinstance(value, Mapping) and isinstance(merged.get(key), Mapping):
+            merged[key] = merge_cv_data(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def apply_variant(
+    base: Mapping[str, Any], overlay: Mapping[str, Any]
+) -> MutableMapping[str, Any]:
+    """
+    Applies a variant overlay onto CV data.
+    Besides the fields merged by `merge_cv_data`, where sections can be added,
+    overridden or removed (with a null value) through the "sections" mapping,
+    the overlay can specify a "sectionsOrder" list of section ids: those sections
+    are rendered first in the given order, followed by the remaining ones.
+    :param base: the base CV data
+    :param overlay: the variant overlay data
+    :raise ValueError: if the overlay or the resulting CV data are malformed
+    :return: the CV data for the variant
+    """
+    if not isinstance(overlay, Mapping):
+        raise ValueError("Variant overlay must be a json object")
+    overlay = dict(overlay)
+    sections_order: Optional[Collection[str]] = overlay.pop(
+        VARIANT_SECTIONS_ORDER_KEY, None
+    )
+    if sections_order is not None and (
+        not isinstance(sections_order, list)
+        or not all(isinstance(sid, str) for sid in sections_order)
+    ):
+        raise ValueError(
+            f'Variant "{VARIANT_SECTIONS_ORDER_KEY}" must be a list of strings'
+        )
+    merged: MutableMapping[str, Any] = merge_cv_data(base, overlay)
+    validate_cv_data(merged)
+    if sections_order is not None:
+        sections: Mapping[str, Any] = merged["sections"]
+        unknown_ids: Set[str] = set(sections_order) - set(sections)
+        if unknown_ids:
+            app.logger.warning(
+                f"Ignoring unknown sections in variant order: {sorted(unknown_ids)}"
+            )
+        merged["sections"] = {
+            **{sid: sections[sid] for sid in sections_order if sid in sections},
+            **sections,
+        }
+    return merged
+
+
+def validate_cv_data(data: Any) -> None:
+    """
+    Checks that CV data has the minimal structure required to be served
+    :param data: the CV data to validate
+    :raise ValueError: if the CV data is malformed
+    """
+    if not isinstance(data, Mapping):
+        raise ValueError("CV data must be a json object")
+    if not isinstance(data.get("title"), str):
+        raise ValueError('CV data must have a string "title"')
+    if not isinstance(data.get("sections"), Mapping):
+        raise ValueError('CV data must have a "sections" object')
+
+
+def compile_cv(data: Mapping[str, Any]) -> CompiledCV:
+    """
+    Compiles CV data for serving, pre-serializing it and extracting page metadata
+    :param data: the CV data to compile
+    :raise ValueError: if the CV data is malformed
+    :return: the compiled CV object
+    """
+    validate_cv_data(data)
+    data_json: bytes = json.dumps(data).encode()
+    return CompiledCV(
+        data=data,
+        json=data_json,
+        etag=f"{zlib.adler32(data_json):08x}-{len(data_json)}",
+        title=data["title"],
+        repo_url=data.get("cv_repo_url"),
+    )
+
+
+class CompiledCVCache:
+    """
+    Bounded LRU cache of compiled CV documents, keyed by variant name (None for
+    the base CV data) and invalidated when either the base or overlay file changes.
+    Compilation failures are cached as well, until the files change, and
+    compilations are serialized so concurrent misses compile only once.
+    """
+
+    def __init__(self, maxsize: int = COMPILED_CV_CACHE_SIZE):
+        self.maxsize: int = maxsize
+        self._entries: "OrderedDict[Optional[str], CompiledCVEntry]" = OrderedDict()
+        self._lock: RLock = RLock()
+        self._compile_lock: RLock = RLock()
+
+    def _lookup(
+        self, variant: Optional[str], versions: Tuple[Optional[FileVersion], ...]
+    ) -> Optional[CompiledCV]:
+        """
+        Looks up an up-to-date cache entry, re-raising a cached failure
+        :param variant: the name of the variant, or None for the base CV data
+        :param versions: the current versions of the base and overlay files
+        :return: the compiled CV object, or None if missing or outdated
+        """
+        with self._lock:
+            entry: Optional[CompiledCVEntry] = self._entries.get(variant)
+            if entry is None or entry[0] != versions:
+                return None
+            self._entries.move_to_end(variant)
+        if isinstance(entry[1], Exception):
+            raise entry[1].with_traceback(None)
+        return entry[1]
+
+    def _compile(self, variant: Optional[str]) -> CompiledCV:
+        """
+        Reads and compiles a CV document
+        :param variant: the name of the variant, or None for the base CV data
+        :return: the compiled CV object
+        """
+        if variant is None:
+            with open(CV_DATA_PATH, "rb") as fp:
+                return compile_cv(json.load(fp))
+        base: CompiledCV = self.get(None)
+        with open(variant_path(variant), "rb") as fp:
+            overlay: Any = json.load(fp)
+        return compile_cv(apply_variant(base["data"], overlay))
+
+    def get(self, variant: Optional[str] = None) -> CompiledCV:
+        """
+        Gets a compiled CV document, compiling it if missing or outdated
+        :param variant: the name of the variant, or None for the base CV data
+        :raise FileNotFoundError: if the base or variant overlay files are missing
+        :raise ValueError: if the variant name, base or overlay data are invalid
+        :return: the compiled CV object
+        """
+        versions: Tuple[Optional[FileVersion], ...] = (file_version(CV_DATA_PATH),)
+        if variant is not None:
+            versions += (file_version(variant_path(variant)),)
+        compiled: Optional[CompiledCV] = self._lookup(variant, versions)
+        if compiled is not None:
+            return compiled
+        with self._compile_lock:
+            compiled = self._lookup(variant, versions)
+            if compiled is not None:
+                return compiled
+            result: Union[CompiledCV, Exception]
+            try:
+                result = self._compile(variant)
+            except (FileNotFoundError, ValueError) as exc:
+                app.logger.error(f"Cannot compile CV variant {variant!r}: {exc}")
+                result = exc
+            with self._lock:
+                self._entries[variant] = (versions, result)
+                self._entries.move_to_end(variant)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+compiled_cv_cache: CompiledCVCache = CompiledCVCache()
+
+
+def client_key(address: str) -> str:
+    """
+    Gets the admission control key of a client address.
+    IPv6 addresses are grouped by their /64 prefix, since a single host
+    usually controls a whole one.
+    :param address: the client ip address
+    :return: the client key
+    """
+    ip: Union[ipaddress.IPv4Address, ipaddress.IPv6Address]
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return address
+    if isinstance(ip, ipaddress.IPv6Address):
+        if ip.ipv4_mapped is not None:
+            return str(ip.ipv4_mapped)
+        return str(ipaddress.IPv6Network((ip, 64), strict=False))
+    return str(ip)
+
+
+class RecentTokens:
+    """
+    Bounded LRU cache of recently validated tokens. Requests with these tokens
+    skip the database lookup and the invalid tokens budget precheck.
+    Tokens are re-validated against the database after `ttl` seconds.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = ADMISSION_RECENT_TOKENS,
+        ttl: float = ADMISSION_RECENT_TOKENS_TTL,
+    ):
+        self.maxsize: int = maxsize
+        self.ttl: float = ttl
+        self._tokens: "OrderedDict[str, Tuple[float, Token]]" = OrderedDict()
+        self._lock: RLock = RLock()
+
+    def get(self, token_id: str) -> Optional[Token]:
+        """
+        Gets a recently validated token, if still fresh and not expired
+        :param token_id: the token id
+        :return: the token object, or None if not recently validated
+        """
+        with self._lock:
+            entry: Optional[Tuple[float, Token]] = self._tokens.get(token_id)
+            if entry is None:
+                return None
+            validated, token = entry
+            if (
+                time.monotonic() - validated > self.ttl
+                or datetime.now() > token["expiry"]
+            ):
+                del self._tokens[token_id]
+                return None
+            self._tokens.move_to_end(token_id)
+            return token
+
+    def add(self, token: Token) -> None:
+        """
+        Stores a token that was just validated
+        :param token: the valid token object
+        """
+        with self._lock:
+            self._tokens[token["id"]] = (time.monotonic(), token)
+            self._tokens.move_to_end(token["id"])
+            while len(self._tokens) > self.maxsize:
+                self._tokens.popitem(last=False)
+
+
+class _ClientBudget:
+    """Compact per-client token buckets state used by `AdmissionController`"""
+
+    __slots__ = ("valid", "invalid", "updated", "rejected", "tier")
+
+    def __init__(self, valid: float, invalid: float, updated: float):
+        self.valid: float = valid
+        self.invalid: float = invalid
+        self.updated: float = updated
+        self.rejected: int = 0
+        self.tier: int = 0
+
+
+class AdmissionController:
+    """
+    In-memory per-client admission control for token-protected routes.
+    Each client (see `client_key`) has two token buckets, one charged for requests
+    with valid tokens and one for invalid ones. Clients that exhausted the invalid
+    budget are rejected before any database lookup. Rejections are only counted,
+    and sampled to the app logger, instead of being logged to the database.
+    Memory is bounded by evicting idle clients and, if needed, the least recent
+    ones, starting from untouched budgets, then partially spent invalid budgets,
+    and throttled clients last.
+    """
+
+    TIER_CLEAN: int = 0
+    TIER_CHARGED: int = 1
+    TIER_THROTTLED: int = 2
+
+    def __init__(
+        self,
+        valid_rate: float = ADMISSION_VALID_RATE,
+        valid_burst: float = ADMISSION_VALID_BURST,
+        invalid_rate: float = ADMISSION_INVALID_RATE,
+        invalid_burst: float = ADMISSION_INVALID_BURST,
+        max_clients: int = ADMISSION_MAX_CLIENTS,
+        idle_seconds: float = ADMISSION_IDLE_SECONDS,
+        log_sample: int = ADMISSION_LOG_SAMPLE,
+    ):
+        self.valid_rate: float = valid_rate
+        self.valid_burst: float = valid_burst
+        self.invalid_rate: float = invalid_rate
+        self.invalid_burst: float = invalid_burst
+        self.max_clients: int = max_clients
+        self.idle_seconds: float = idle_seconds
+        self.log_sample: int = log_sample
+        self.admitted: int = 0
+        self.rejected_valid: int = 0
+        self.rejected_invalid: int = 0
+        self._tiers: List["OrderedDict[str, _ClientBudget]"] = [
+            OrderedDict() for _ in range(self.TIER_THROTTLED + 1)
+        ]
+        self._lock: RLock = RLock()
+
+    def _refilled(self, budget: _ClientBudget, now: float) -> Tuple[float, float]:
+        """
+        Computes the budget values of a client refilled up to now, without altering it
+        :param budget: the client budget object
+        :param now: the current monotonic time
+        :return: a (valid, invalid) budget values tuple
+        """
+        elapsed: float = now - budget.updated
+        return (
+            min(self.valid_burst, budget.valid + elapsed * self.valid_rate),
+            min(self.invalid_burst, budget.invalid + elapsed * self.invalid_rate),
+        )
+
+    def _get_budget(self, client: str, now: float) -> _ClientBudget:
+        """
+        Gets the refilled budget of a client, creating it if missing,
+        and evicts idle or excess clients. Must be called holding the lock.
+        :param client: the client identifier
+        :param now: the current monotonic time
+        :return: the client budget object
+        """
+        budget: Optional[_ClientBudget] = None
+        for tier in self._tiers:
+            budget = tier.get(client)
+            if budget is not None:
+                tier.move_to_end(client)
+                break
+        if budget is None:
+            budget = _ClientBudget(self.valid_burst, self.invalid_burst, now)
+            self._tiers[self.TIER_CLEAN][client] = budget
+        else:
+            budget.valid, budget.invalid = self._refilled(budget, now)
+            budget.updated = now
+        self._evict(now, keep=client)
+        return budget
+
+    def _evict(self, now: float, keep: str) -> None:
+        """
+        Evicts idle clients, then the least recent ones of the lowest tiers
+        while there are too many. Must be called holding the lock.
+        :param now: the current monotonic time
+        :param keep: the client identifier to never evict
+        """
+        for tier in self._tiers:
+            while tier:
+                oldest_client: str = next(iter(tier))
+                if (
+                    oldest_client == keep
+                    or now - tier[oldest_client].updated < self.idle_seconds
+                ):
+                    break
+                del tier[oldest_client]
+        while sum(len(tier) for tier in self._tiers) > self.max_clients:
+            for tier in self._tiers:
+                oldest_client = next(iter(tier), keep)
+                if oldest_client != keep:
+                    del tier[oldest_client]
+                    break
+            else:
+                break
+
+    def _update_tier(self, client: str, budget: _ClientBudget) -> None:
+        """
+        Moves a client to the eviction tier matching its budget state.
+        Must be called holding the lock.
+        :param client: the client identifier
+        :param budget: the client budget object
+        """
+        tier: int
+        if budget.rejected:
+            tier = self.TIER_THROTTLED
+        elif budget.invalid < self.invalid_burst:
+            tier = self.TIER_CHARGED
+        else:
+            tier = self.TIER_CLEAN
+        if tier != budget.tier:
+            del self._tiers[budget.tier][client]
+            budget.tier = tier
+            self._tiers[tier][client] = budget
+
+    def _reject(self, client: str, budget: _ClientBudget, token_valid: bool) -> None:
+        """
+        Records a rejected request, logging only a sample of them
+        :param client: the client identifier
+        :param budget: the client budget object
+        :param token_valid: whether the rejection was charged to the valid budget
+        """
+        budget.rejected += 1
+        self._update_tier(client, budget)
+        if token_valid:
+            self.rejected_valid += 1
+        else:
+            self.rejected_invalid += 1
+        if budget.rejected == 1 or budget.rejected % self.log_sample == 0:
+            app.logger.warning(
+                f"Throttled client {client} ({budget.rejected} rejected requests,"
+                f" {'valid' if token_valid else 'invalid'} tokens budget exhausted)"
+            )
+
+    def precheck(self, client: str) -> Optional[float]:
+        """
+        Checks whether a client may make a request at all, before validating
+        its token: clients that exhausted the invalid tokens budget are rejected.
+        :param client: the client identifier
+        :return: None if the request can proceed, otherwise the seconds until
+            the client can retry
+        """
+        with self._lock:
+            budget: _ClientBudget = self._get_budget(client, time.monotonic())
+            if budget.invalid < 1.0:
+                self._reject(client, budget, token_valid=False)
+                return (1.0 - budget.invalid) / self.invalid_rate
+            return None
+
+    def charge(self, client: str, token_valid: bool) -> Optional[float]:
+        """
+        Charges a request to the client budget matching the token validity
+        :param client: the client identifier
+        :param token_valid: whether the requested token is valid
+        :return: None if the request is admitted, otherwise the seconds until
+            the client can retry
+        """
+        with self._lock:
+            budget: _ClientBudget = self._get_budget(client, time.monotonic())
+            if token_valid:
+                if budget.valid < 1.0:
+                    self._reject(client, budget, token_valid=True)
+                    return (1.0 - budget.valid) / self.valid_rate
+                budget.valid -= 1.0
+            else:
+                if budget.invalid < 1.0:
+                    self._reject(client, budget, token_valid=False)
+                    return (1.0 - budget.invalid) / self.invalid_rate
+                budget.invalid -= 1.0
+                self._update_tier(client, budget)
+            self.admitted += 1
+            return None
+
+    def stats(self) -> MutableMapping[str, Any]:
+        """
+        Gets the configured limits, global counters and currently throttled clients
+        :return: a serializable mapping of the admission control stats
+        """
+        with self._lock:
+            now: float = time.monotonic()
+            offenders: List[MutableMapping[str, Any]] = []
+            for tier in self._tiers:
+                for client, budget in tier.items():
+                    valid, invalid = self._refilled(budget, now)
+                    if valid >= 1.0 and invalid >= 1.0:
+                        continue
+                    offenders.append(
+                        dict(
+                            client=client,
+                            rejected=budget.rejected,
+                            valid_budget=round(valid, 2),
+                            invalid_budget=round(invalid, 2),
+                            idle_seconds=round(now - budget.updated, 1),
+                        )
+                    )
+            offenders.sort(key=lambda o: o["rejected"], reverse=True)
+            return dict(
+                limits=dict(
+                    valid_rate=self.valid_rate,
+                    valid_burst=self.valid_burst,
+                    invalid_rate=self.invalid_rate,
+                    invalid_burst=self.invalid_burst,
+                    max_clients=self.max_clients,
+                    idle_seconds=self.idle_seconds,
+                ),
+                admitted=self.admitted,
+                rejected_valid=self.rejected_valid,
+                rejected_invalid=self.rejected_invalid,
+                tracked_clients=sum(len(tier) for tier in self._tiers),
+                throttled_clients=len(self._tiers[self.TIER_THROTTLED]),
+                offenders=offenders[:ADMISSION_MAX_OFFENDERS],
+            )
+
+
+admission: AdmissionController = AdmissionController()
+recent_tokens: RecentTokens = RecentTokens()
+
+
+def admit_token_request(req: Request, token_id: str) -> Optional[Token]:
+    """
+    Runs admission control for a token-protected request, then validates its token.
+    Recently validated tokens are only charged to the valid tokens budget.
+    Aborts with a 429 error, with a "Retry-After" header, if the client is throttled.
+    :param req: the `flask.Request` object
+    :param token_id: the token id of the request
+    :return: the token object if the token id is valid, None otherwise
+    """
+    client: str = client_key(req.remote_addr or "")
+    retry_after: Optional[float]
+    token: Optional[Token] = recent_tokens.get(token_id)
+    if token is None:
+        retry_after = admission.precheck(client)
+        if retry_after is not None:
+            abort(429, retry_after=math.ceil(retry_after))
+        token = get_valid_token(token_id=token_id)
+        if token is not None:
+            recent_tokens.add(token)
+    retry_after = admission.charge(client, token_valid=token is not None)
+    if retry_after is not None:
+        abort(429, retry_after=math.ceil(retry_after))
+    return token
+
+
+# pylint: disable=inconsistent-return-statements
+def get_compiled_cv(token: Token) -> CompiledCV:
+    """
+    Gets the compiled CV document for a token's variant.
+    Aborts with a 404 error if it cannot be served (errors are logged by the cache).
+    :param token: the valid token object
+    :return: the compiled CV object
+    """
+    try:
+        return compiled_cv_cache.get(token["variant"])
+    except (FileNotFoundError, ValueError):
+        abort(404)
+
+
 # pylint: disable=inconsistent-return-statements
 @app.route("/cv/<string:token_id>")
 def cv(token_id: str) -> Response:
     """
     CV route endpoint function.
     Renders a CV page, but only when called with a valid token id,
-    otherwise returns a 404 error.
+    otherwise returns a 404 error (or 429 if the client is throttled).
     :param token_id: the token id part of the path
     :return: the rendered CV page response
     """
-    token_valid: bool = validate_token(token_id=token_id)
-    log_request(request, token_id=token_id, token_valid=token_valid)
-    if token_valid:
-        cv_data_url: str = "static/cvdata.json"
-        cv_repo_url: Optional[str]
-        with open(cv_data_url, "rb") as fp:
-            cv_data: MutableMapping[str, Any] = json.load(fp)
-            cv_title: str = cv_data["title"]
-            cv_repo_url = cv_data.get("cv_repo_url")
+    token: Optional[Token] = admit_token_request(request, token_id=token_id)
+    log_request(request, token_id=token_id, token_valid=token is not None)
+    if token is not None:
+        compiled: CompiledCV = get_compiled_cv(token)
+        cv_data_url: str
+        if token["variant"] is not None:
+            cv_data_url = url_for("cv_data", token_id=token_id)
+        else:
+            cv_data_url = "/" + CV_DATA_URL
         return render_template(
             "cv.html",
-            cv_title=cv_title,
-            cv_data_url="/" + cv_data_url,
-            cv_repo_url=cv_repo_url,
+            cv_title=compiled["title"],
+            cv_data_url=cv_data_url,
+            cv_repo_url=compiled["repo_url"],
         )
     abort(404)
 
 
+# pylint: disable=inconsistent-return-statements
+@app.route("/cv/<string:token_id>/cvdata.json")
+def cv_data(token_id: str) -> Response:
+    """
+    CV data route endpoint function.
+    Serves the compiled CV data for the token's variant, but only when called
+    with a valid token id, otherwise returns a 404 error (or 429 if throttled).
+    Requests with invalid tokens are logged, while valid ones are not,
+    since the page view they belong to was already logged by `cv`.
+    :param token_id: the token id part of the path
+    :return: the CV data json response
+    """
+    token: Optional[Token] = admit_token_request(request, token_id=token_id)
+    if token is None:
+        log_request(request, token_id=token_id, token_valid=False)
+        abort(404)
+    compiled: CompiledCV = get_compiled_cv(token)
+    response: Response = Response(compiled["json"], mimetype="application/json")
+    response.set_etag(compiled["etag"])
+    return response.make_conditional(request)
+
+
+@app.route("/admission")
+@auth.login_required
+def admission_stats() -> Response:
+    """
+    Route endpoint function to inspect the admission control state.
+    Requires HTTP authentication by a valid admin user, as stored in the database.
+    :return: a json response with the limits, counters and current offenders
+    """
+    user: User = auth.current_user()
+    if not user["is_admin"]:
+        abort(403)
+    return jsonify(admission.stats())
+
+
 app.before_first_request(ensure_db_schema)
 
 
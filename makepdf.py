@@ -245,6 +245,7 @@ def create_token(
     base_url: str,
     token_name: str,
     expiry: Optional[str] = None,
+    variant: Optional[str] = None,
     user: Optional[str] = None,
     password: Optional[str] = None,
 ) -> str:
@@ -254,6 +255,8 @@ def create_token(
     :param token_name: the name of the new token to create
     :param expiry: a string indicating the expiry interval from now,
         if omitted, the default value configured in the server app will be used
+    :param variant: the name of the CV variant to serve for the token,
+        if omitted, the base CV data will be used
     :param user: the username to use for authentication, if omitted, it will be
         prompted for input at runtime
     :param password: the password to use for authentication, if omitted, it will be
@@ -269,6 +272,8 @@ def create_token(
     params: MutableMapping[str, Any] = dict()
     if expiry:
         params["expiry"] = expiry
+    if variant:
+        params["variant"] = variant
     print(f'Creating new token "{token_name}"')
     response: requests.Response = requests.get(
         url=token_url, params=params, auth=(user, password)
@@ -327,6 +332,9 @@ def main():
     create_token_args.add_argument(
         "-e", "--expiry", help="Expiry for the new token, if different from default"
     )
+    create_token_args.add_argument(
+        "-v", "--variant", help="Name of the CV variant to serve for the new token"
+    )
     create_token_args.add_argument("-u", "--user", help="Username for authentication")
     create_token_args.add_argument(
         "-p", "--password", help="Password for authentication"
@@ -344,6 +352,7 @@ def main():
             args.base_url,
             args.token_name,
             expiry=args.expiry,
+            variant=args.variant,
             user=args.user,
             password=args.password,
         )